@@ -1,13 +1,19 @@
 import os
+import io
+import mmap
 import json
 import shutil
+import struct
+import subprocess
 import tempfile
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import re
 import xml.etree.ElementTree as ET
 from datetime import datetime
-from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_file
+from functools import lru_cache
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import piexif
@@ -15,6 +21,19 @@ from PIL import Image
 import hashlib
 import requests
 
+# orjson is optional; it parses Takeout sidecars several times faster
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# blake3 is optional too; blake2b is the fastest hashlib fallback
+try:
+    from blake3 import blake3 as new_hasher
+except ImportError:
+    new_hasher = hashlib.blake2b
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 # CORS configuration for support API
@@ -34,32 +53,136 @@ app.config['SECRET_KEY'] = os.environ.get('SESSION_SECRET', 'dev-secret-key')
 
 UPLOAD_FOLDER = tempfile.gettempdir()
 ALLOWED_EXTENSIONS = {'zip'}
+COPY_BUFSIZE = 1024 * 1024  # 1 MiB buffer for streaming ZIP members
+EXTRACT_BUFFER_LIMIT = 16 * 1024 * 1024  # larger members are streamed, not buffered
+EXTRACT_INFLIGHT = 8        # buffered members waiting to be written
+EXIFTOOL_BATCH_SIZE = 500   # paths per -execute when exiftool is available
+DEDUP_HEAD_SIZE = 64 * 1024  # bytes hashed to probe same-size files for duplicates
+OUTPUT_PREFETCH = 8          # JPEGs read and patched ahead of the ZIP writer
 
 # WhatsApp filename pattern: IMG/VID-YYYYMMDD-WAxxxx
 WA_PATTERN = re.compile(r'(?:IMG|VID)[-_](\d{4})(\d{2})(\d{2})[-_]WA\d+', re.IGNORECASE)
 
+# Generic filename date patterns, tried in order (first valid date wins)
+FILENAME_DATE_PATTERNS = [re.compile(p) for p in (
+    r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})',
+    r'(\d{4})(\d{2})(\d{2})[_-](\d{2})(\d{2})(\d{2})',
+    r'IMG[-_](\d{4})(\d{2})(\d{2})[-_](\d{2})(\d{2})(\d{2})',
+    r'VID[-_](\d{4})(\d{2})(\d{2})[-_](\d{2})(\d{2})(\d{2})',
+    # WhatsApp-specific pattern handled separately
+    r'IMG[-_](\d{4})(\d{2})(\d{2})[-_]\d+',
+    r'(\d{4})[-_](\d{2})[-_](\d{2})',
+    r'(\d{4})(\d{2})(\d{2})',
+)]
+# Every pattern above contains this, so one scan rules most filenames out
+FILENAME_DATE_HINT = re.compile(r'\d{4}[-_]?\d{2}[-_]?\d{2}')
+
+# XMP date tags in order of preference, matched as bytes in one pass
+XMP_DATE_TAGS = (b'xmp:CreateDate', b'exif:DateTimeOriginal', b'photoshop:DateCreated')
+XMP_DATE_RE = re.compile(
+    rb'(xmp:CreateDate|exif:DateTimeOriginal|photoshop:DateCreated)[=>"\s]+'
+    rb'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})')
+XMP_ORIENTATION_RE = re.compile(rb'tiff:Orientation[=>"\s]+(\d+)')
+
+# Photo extensions that mark an upload as a photo export (tuple for str.endswith)
+DETECT_PHOTO_EXTS = ('.jpg', '.jpeg', '.png', '.heic', '.heif')
+
+# Photo extensions that get processed, and the subset that gets EXIF written
+PHOTO_EXTS = frozenset({'.jpg', '.jpeg', '.png', '.heic', '.heif', '.gif', '.bmp', '.webp'})
+JPEG_EXTS = frozenset({'.jpg', '.jpeg'})
+
+# Upload members that are ever read back: photos plus Takeout JSON sidecars
+EXTRACT_EXTS = PHOTO_EXTS | {'.json'}
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def safe_extract_zip(zip_file, extract_path):
-    abs_extract_path = os.path.abspath(extract_path)
+def _file_ext(path):
+    """
+    Lower-cased suffix after the last dot ('.jpg' for 'IMG.JPG'); a
+    leading-dot name like '.jpg' keeps its suffix. '' when there is no dot.
+    """
+    name = os.path.basename(path)
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot != -1 else ''
 
-    for member in zip_file.namelist():
-        if os.path.isabs(member):
-            raise ValueError(f"ZIP contains absolute path: {member}")
 
-        member_path = os.path.abspath(os.path.join(extract_path, member))
+def safe_extract_zip(zip_file, extract_path, wanted_exts=None):
+    """
+    Validate every member path, then extract the files. When wanted_exts
+    is given, members with other extensions (videos, HTML, ...) are not
+    written to disk at all.
+    """
+    abs_extract_path = os.path.abspath(extract_path)
+    base = os.path.join(abs_extract_path, '')
+
+    # Validate and plan in one pass; nothing is written until all names pass
+    members = {}  # target -> info; a repeated name keeps the last entry
+    folders = set()
+    for info in zip_file.infolist():
+        member = info.filename
+        if member.startswith(('/', '\\')) or os.path.isabs(member):
+            raise ValueError(f"ZIP contains absolute path: {member}")
+        if '..' in member.replace('\\', '/').split('/'):
+            raise ValueError(f"ZIP contains unsafe path: {member}")
 
-        try:
-            common = os.path.commonpath([abs_extract_path, member_path])
-            if common != abs_extract_path:
-                raise ValueError(f"ZIP contains path traversal: {member}")
-        except ValueError:
+        target = os.path.normpath(os.path.join(abs_extract_path, member))
+        if target != abs_extract_path and not target.startswith(base):
             raise ValueError(f"ZIP contains unsafe path: {member}")
 
-    zip_file.extractall(extract_path)
+        if info.is_dir():
+            folders.add(target)
+        elif wanted_exts is None or _file_ext(target) in wanted_exts:
+            folders.add(os.path.dirname(target))
+            members[target] = info
+
+    for folder in sorted(folders):
+        os.makedirs(folder, exist_ok=True)
+
+    # A ZipFile is not meant to be shared between threads, so members are
+    # read here one at a time and only the disk writes go to the pool.
+    # At most EXTRACT_INFLIGHT small members are buffered; larger ones are
+    # streamed straight to disk so a huge member never sits in memory.
+    def write_one(target, data):
+        with open(target, 'wb') as dst:
+            dst.write(data)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        for target, info in members.items():
+            if info.file_size > EXTRACT_BUFFER_LIMIT:
+                with zip_file.open(info) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+                continue
+            if len(pending) >= EXTRACT_INFLIGHT:
+                pending.popleft().result()
+            pending.append(executor.submit(write_one, target, zip_file.read(info)))
+        for future in pending:
+            future.result()
+
+
+def open_upload_zip(file, temp_dirs):
+    """
+    Open the uploaded ZIP where Werkzeug already spooled it (in memory for
+    small uploads, an anonymous temp file otherwise) instead of saving
+    another copy first. Falls back to file.save() for streams that can't
+    be read in place.
+    """
+    stream = file.stream
+    try:
+        stream.seek(0)
+        if stream.seekable() and stream.readable():
+            return zipfile.ZipFile(stream, 'r')
+    except (AttributeError, OSError, ValueError):
+        pass
+
+    upload_dir = tempfile.mkdtemp(prefix='upload_')
+    temp_dirs.append(upload_dir)
+    zip_path = os.path.join(upload_dir, secure_filename(file.filename or 'upload.zip'))
+    file.save(zip_path)
+    return zipfile.ZipFile(zip_path, 'r')
 
 
 def cleanup_temp_dirs(temp_dirs):
@@ -73,33 +196,26 @@ def cleanup_temp_dirs(temp_dirs):
 
 def extract_xmp_metadata(image_path):
     try:
+        # mmap the file so only the pages around the XMP packet are read
         with open(image_path, 'rb') as f:
-            content = f.read()
-
-        xmp_start = content.find(b'<x:xmpmeta')
-        xmp_end = content.find(b'</x:xmpmeta>')
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                xmp_start = mm.find(b'<x:xmpmeta')
+                xmp_end = mm.find(b'</x:xmpmeta>', xmp_start) if xmp_start != -1 else -1
+                xmp_data = mm[xmp_start:xmp_end + 12] if xmp_end != -1 else None
+
+        if xmp_data is not None:
+            try:
+                dates = {}
+                for match in XMP_DATE_RE.finditer(xmp_data):
+                    dates.setdefault(match.group(1), match.group(2))
 
-        if xmp_start != -1 and xmp_end != -1:
-            xmp_data = content[xmp_start:xmp_end + 12]
+                for tag in XMP_DATE_TAGS:
+                    if tag in dates:
+                        return {'timestamp': _parse_exif_dt(dates[tag]), 'orientation': None}
 
-            try:
-                xmp_str = xmp_data.decode('utf-8', errors='ignore')
-
-                date_patterns = [
-                    r'xmp:CreateDate[=>"\s]+(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})',
-                    r'exif:DateTimeOriginal[=>"\s]+(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})',
-                    r'photoshop:DateCreated[=>"\s]+(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})',
-                ]
-
-                for pattern in date_patterns:
-                    match = re.search(pattern, xmp_str)
-                    if match:
-                        date_str = match.group(1)
-                        dt = datetime.strptime(date_str[:19], '%Y-%m-%dT%H:%M:%S')
-                        return {'timestamp': int(dt.timestamp()), 'orientation': None}
-
-                orientation_pattern = r'tiff:Orientation[=>"\s]+(\d+)'
-                orient_match = re.search(orientation_pattern, xmp_str)
+                orient_match = XMP_ORIENTATION_RE.search(xmp_data)
                 orientation = int(orient_match.group(1)) if orient_match else None
 
                 return {'timestamp': None, 'orientation': orientation}
@@ -117,19 +233,11 @@ def parse_filename_for_date(filename):
     Generic filename-based timestamp (non-WhatsApp).
     Returns a POSIX timestamp or None.
     """
-    patterns = [
-        r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})[-_]?(\d{2})',
-        r'(\d{4})(\d{2})(\d{2})[_-](\d{2})(\d{2})(\d{2})',
-        r'IMG[-_](\d{4})(\d{2})(\d{2})[-_](\d{2})(\d{2})(\d{2})',
-        r'VID[-_](\d{4})(\d{2})(\d{2})[-_](\d{2})(\d{2})(\d{2})',
-        # WhatsApp-specific pattern handled separately
-        r'IMG[-_](\d{4})(\d{2})(\d{2})[-_]\d+',
-        r'(\d{4})[-_](\d{2})[-_](\d{2})',
-        r'(\d{4})(\d{2})(\d{2})',
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, filename)
+    if FILENAME_DATE_HINT.search(filename) is None:
+        return None
+
+    for pattern in FILENAME_DATE_PATTERNS:
+        match = pattern.search(filename)
         if match:
             groups = match.groups()
             try:
@@ -168,8 +276,8 @@ def get_timestamp_from_filename(filename):
 
 def parse_google_takeout_json(json_path):
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_path, 'rb') as f:
+            data = json_loads(f.read())
 
         timestamp = None
         if 'photoTakenTime' in data:
@@ -187,6 +295,132 @@ def parse_google_takeout_json(json_path):
         return None
 
 
+def _parse_exif_dt(value):
+    """
+    Parse an EXIF 'YYYY:MM:DD HH:MM:SS' value (bytes or str) into a POSIX
+    timestamp. The layout is fixed, so slicing is used instead of the much
+    slower strptime; XMP's 'YYYY-MM-DDTHH:MM:SS' parses the same way.
+    Raises ValueError for malformed values.
+    """
+    if isinstance(value, bytes):
+        value = value.decode('ascii')
+    dt = datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                  int(value[11:13]), int(value[14:16]), int(value[17:19]))
+    return int(dt.timestamp())
+
+
+# Tags set_exif_datetime cares about, per IFD, plus the Exif IFD pointer
+_FAST_EXIF_TAGS = {
+    '0th': (piexif.ImageIFD.Orientation, piexif.ImageIFD.DateTime),
+    'Exif': (piexif.ExifIFD.DateTimeOriginal, piexif.ExifIFD.DateTimeDigitized),
+}
+
+
+def _read_ifd(tiff, endian, pointer, wanted):
+    """
+    Returns ({tag: value} for the wanted tags, Exif IFD pointer or None).
+    Values are converted the way piexif does; any other type, or a
+    multi-value SHORT/LONG, raises ValueError so piexif can take over.
+    """
+    count = struct.unpack_from(endian + 'H', tiff, pointer)[0]
+    found = {}
+    exif_pointer = None
+    for offset in range(pointer + 2, pointer + 2 + 12 * count, 12):
+        tag, value_type, length = struct.unpack_from(endian + 'HHL', tiff, offset)
+        if tag != piexif.ImageIFD.ExifTag and tag not in wanted:
+            continue
+        value = tiff[offset + 8:offset + 12]
+        if value_type == 2:  # ASCII, NUL terminator dropped
+            if length > 4:
+                data_pointer = struct.unpack(endian + 'L', value)[0]
+                data = tiff[data_pointer:data_pointer + length - 1]
+            else:
+                data = value[0:length - 1]
+        elif value_type == 3 and length == 1:  # SHORT
+            data = struct.unpack(endian + 'H', value[0:2])[0]
+        elif value_type == 4 and length == 1:  # LONG
+            data = struct.unpack(endian + 'L', value)[0]
+        else:
+            raise ValueError(f"unhandled EXIF type {value_type} for tag {tag}")
+        if tag == piexif.ImageIFD.ExifTag:
+            exif_pointer = data
+        else:
+            found[tag] = data
+    return found, exif_pointer
+
+
+def _read_jpeg_exif(image_path):
+    """
+    Reads only orientation and the three date tags from a JPEG's APP1
+    segment, walking IFD0 and the Exif IFD and nothing else (no MakerNote,
+    GPS or thumbnail). Returns a piexif-shaped dict, or None when the file
+    is not a JPEG or its EXIF is unusual, so the caller can use piexif.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            # Same segment walk as piexif: stop at the first Exif APP1
+            segment = None
+            head = f.read(4)
+            while len(head) == 4:
+                length = struct.unpack('>H', head[2:4])[0]
+                if head[:2] == b'\xff\xe1':
+                    data = f.read(length - 2)
+                    if data[:4] == b'Exif':
+                        segment = data
+                        break
+                    head = f.read(4)
+                elif head[0:1] == b'\xff':
+                    f.read(length - 2)
+                    head = f.read(4)
+                else:
+                    break
+
+        exif_dict = {'0th': {}, 'Exif': {}}
+        if segment is None:
+            return exif_dict
+
+        tiff = segment[6:]
+        endian = '<' if tiff[0:2] == b'II' else '>'
+        ifd0 = struct.unpack(endian + 'L', tiff[4:8])[0]
+        exif_dict['0th'], exif_pointer = _read_ifd(tiff, endian, ifd0, _FAST_EXIF_TAGS['0th'])
+        if exif_pointer is not None:
+            exif_dict['Exif'] = _read_ifd(tiff, endian, exif_pointer, _FAST_EXIF_TAGS['Exif'])[0]
+        return exif_dict
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def get_exif_timestamp(image_path):
+    """
+    Returns (timestamp, exif_dict). exif_dict is None when the file has no
+    readable EXIF block.
+
+    JPEGs go through _read_jpeg_exif, which decodes only the tags used
+    downstream. piexif reads the rest (and unusual JPEGs) straight from
+    the file; PIL is only opened for other formats that can embed EXIF
+    (e.g. PNG eXIf chunks).
+    """
+    exif_dict = _read_jpeg_exif(image_path)
+    if exif_dict is None:
+        try:
+            try:
+                exif_dict = piexif.load(image_path)
+            except piexif.InvalidImageDataError:
+                with Image.open(image_path) as img:
+                    exif_dict = piexif.load(img.info.get('exif', b''))
+        except:
+            return None, None
+
+    try:
+        if piexif.ExifIFD.DateTimeOriginal in exif_dict.get('Exif', {}):
+            return _parse_exif_dt(exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal]), exif_dict
+    except:
+        pass
+    return None, exif_dict
+
+
 def get_apple_photos_metadata(image_path):
     try:
         img = Image.open(image_path)
@@ -206,91 +440,239 @@ def get_apple_photos_metadata(image_path):
         return None
 
 
-def set_exif_datetime(image_path, timestamp):
+def read_exif_timestamps_exiftool(image_paths):
+    """
+    Read EXIF DateTimeOriginal for many files through a single exiftool
+    process in -stay_open mode, instead of parsing each file in Python.
+    Also covers HEIC, which PIL cannot open. Returns {path: timestamp};
+    empty if exiftool is not installed. Paths missing from the result
+    should be read per file as usual.
+    """
+    exiftool = shutil.which('exiftool')
+    if not exiftool or not image_paths:
+        return {}
+
+    try:
+        proc = subprocess.Popen(
+            [exiftool, '-stay_open', 'True', '-@', '-',
+             '-common_args', '-j', '-q', '-EXIF:DateTimeOriginal'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8'
+        )
+    except OSError as e:
+        print(f"Error starting exiftool: {e}")
+        return {}
+
+    timestamps = {}
+    try:
+        for start in range(0, len(image_paths), EXIFTOOL_BATCH_SIZE):
+            # The argfile is line-based, so paths containing newlines are left to the fallback
+            batch = [p for p in image_paths[start:start + EXIFTOOL_BATCH_SIZE] if '\n' not in p]
+            proc.stdin.write('\n'.join(batch) + '\n-execute\n')
+            proc.stdin.flush()
+
+            lines = []
+            while True:
+                line = proc.stdout.readline()
+                if not line:
+                    raise RuntimeError('exiftool exited unexpectedly')
+                if line.strip() == '{ready}':
+                    break
+                lines.append(line)
+
+            output = ''.join(lines).strip()
+            if not output:
+                continue
+
+            for item in json_loads(output):
+                date_str = item.get('DateTimeOriginal')
+                if not isinstance(date_str, str):
+                    continue
+                try:
+                    timestamps[item['SourceFile']] = _parse_exif_dt(date_str)
+                except (ValueError, KeyError):
+                    pass
+
+        proc.stdin.write('-stay_open\nFalse\n')
+        proc.stdin.flush()
+    except Exception as e:
+        print(f"Error reading EXIF with exiftool: {e}")
+    finally:
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=10)
+        except Exception:
+            proc.kill()
+
+    return timestamps
+
+
+def _clean_exif_bytes(exif_dict, dt_str):
+    # Preserve orientation if it exists
+    orientation = None
+    if "0th" in exif_dict and piexif.ImageIFD.Orientation in exif_dict["0th"]:
+        orientation = exif_dict["0th"][piexif.ImageIFD.Orientation]
+
+    # Create a clean EXIF structure with only essential tags
+    # This avoids issues with malformed tags from various sources
+    clean_exif = {
+        "0th": {},
+        "Exif": {},
+        "GPS": {},
+        "1st": {},
+        "thumbnail": None
+    }
+
+    # Write timestamps
+    clean_exif["Exif"][piexif.ExifIFD.DateTimeOriginal] = dt_str.encode("utf-8")
+    clean_exif["Exif"][piexif.ExifIFD.DateTimeDigitized] = dt_str.encode("utf-8")
+    clean_exif["0th"][piexif.ImageIFD.DateTime] = dt_str.encode("utf-8")
+
+    # Restore orientation if it existed
+    if orientation is not None:
+        clean_exif["0th"][piexif.ImageIFD.Orientation] = orientation
+
+    return piexif.dump(clean_exif)
+
+
+def _splice_exif(image_data, exif_bytes):
+    """
+    Returns the JPEG bytes with exif_bytes as its Exif APP1 segment, placed
+    the way piexif.insert does it. Only the header segments are walked;
+    the scan data is copied once, straight into the result.
+    """
+    if image_data[0:2] != b'\xff\xd8':
+        raise ValueError("Not a JPEG stream")
+
+    data = memoryview(image_data)
+    segments = [data[0:2]]
+    head = 2
+    while image_data[head:head + 2] != b'\xff\xda':
+        length = struct.unpack('>H', image_data[head + 2:head + 4])[0]
+        end = head + length + 2
+        segments.append(data[head:end])
+        head = end
+        if head >= len(image_data):
+            raise ValueError("Truncated JPEG stream")
+    segments.append(data[head:])
+
+    app1 = b'\xff\xe1' + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes
+    first = segments[1]
+    if (first[0:2] == b'\xff\xe0' and segments[2][0:2] == b'\xff\xe1'
+            and segments[2][4:10] == b'Exif\x00\x00'):
+        # JFIF APP0 followed by Exif APP1: both give way to the new APP1
+        segments[1:3] = [app1]
+    elif first[0:2] == b'\xff\xe0' or (first[0:2] == b'\xff\xe1'
+                                        and first[4:10] == b'Exif\x00\x00'):
+        segments[1] = app1
+    else:
+        segments.insert(1, app1)
+    return b''.join(segments)
+
+
+def set_exif_datetime(image_data, timestamp, exif_dict=None):
     """
     Force-write EXIF timestamps even for images that have NO EXIF block
     (e.g., WhatsApp, Messenger, screenshots, edited images).
+
+    Works on the JPEG bytes in memory and returns the patched bytes. Only
+    the APP1 segment is replaced; the compressed image data is kept
+    byte-for-byte, so there is no decode/re-encode and no quality loss.
+    Pass exif_dict if the caller already parsed the EXIF block.
     """
     dt = datetime.fromtimestamp(timestamp)
-    dt_str = dt.strftime('%Y:%m:%d %H:%M:%S')
+    dt_str = '%04d:%02d:%02d %02d:%02d:%02d' % (
+        dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
 
-    try:
-        img = Image.open(image_path)
-        
-        # Only process actual JPEG images
-        if img.format not in ('JPEG', 'MPO'):
-            img.close()
-            # Just update filesystem timestamps for non-JPEG
-            os.utime(image_path, (timestamp, timestamp))
-            return True
-
-        # Try loading existing EXIF; if missing, create a new structure
+    # Try loading existing EXIF; if missing, start from an empty structure
+    if exif_dict is None:
         try:
-            exif_dict = piexif.load(img.info.get("exif", b""))
+            exif_dict = piexif.load(image_data)
         except:
-            exif_dict = {
-                "0th": {},
-                "Exif": {},
-                "GPS": {},
-                "1st": {},
-                "thumbnail": None
-            }
-
-        # Preserve orientation if it exists
-        orientation = None
-        if "0th" in exif_dict and piexif.ImageIFD.Orientation in exif_dict["0th"]:
-            orientation = exif_dict["0th"][piexif.ImageIFD.Orientation]
-
-        # Create a clean EXIF structure with only essential tags
-        # This avoids issues with malformed tags from various sources
-        clean_exif = {
-            "0th": {},
-            "Exif": {},
-            "GPS": {},
-            "1st": {},
-            "thumbnail": None
-        }
+            exif_dict = {}
 
-        # Write timestamps
-        clean_exif["Exif"][piexif.ExifIFD.DateTimeOriginal] = dt_str.encode("utf-8")
-        clean_exif["Exif"][piexif.ExifIFD.DateTimeDigitized] = dt_str.encode("utf-8")
-        clean_exif["0th"][piexif.ImageIFD.DateTime] = dt_str.encode("utf-8")
+    # Already carries this date in all three tags (re-runs, Takeout photos
+    # whose EXIF agrees with the sidecar): keep the file as it is
+    dt_bytes = dt_str.encode("utf-8")
+    if (exif_dict.get("Exif", {}).get(piexif.ExifIFD.DateTimeOriginal) == dt_bytes
+            and exif_dict["Exif"].get(piexif.ExifIFD.DateTimeDigitized) == dt_bytes
+            and exif_dict.get("0th", {}).get(piexif.ImageIFD.DateTime) == dt_bytes):
+        return image_data
+
+    try:
+        return _splice_exif(image_data, _clean_exif_bytes(exif_dict, dt_str))
+    except Exception:
+        # Not a plain JPEG stream (e.g. a HEIC/PNG saved with a .jpg name)
+        return _set_exif_datetime_pil(image_data, dt_str)
 
-        # Restore orientation if it existed
-        if orientation is not None:
-            clean_exif["0th"][piexif.ImageIFD.Orientation] = orientation
 
-        exif_bytes = piexif.dump(clean_exif)
+def _set_exif_datetime_pil(image_data, dt_str):
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            # Only process actual JPEG images; anything else is kept as-is
+            if img.format not in ('JPEG', 'MPO'):
+                return image_data
 
-        # Save JPEG with EXIF block inserted
-        img.save(image_path, "jpeg", exif=exif_bytes, quality=95)
-        img.close()
+            try:
+                exif_dict = piexif.load(img.info.get("exif", b""))
+            except:
+                exif_dict = {}
 
-        # Also update filesystem timestamps
-        os.utime(image_path, (timestamp, timestamp))
+            exif_bytes = _clean_exif_bytes(exif_dict, dt_str)
 
-        return True
+            # Save JPEG with EXIF block inserted, reusing the source's
+            # quantization tables and subsampling to avoid generation loss
+            output = io.BytesIO()
+            try:
+                img.save(output, "jpeg", exif=exif_bytes,
+                         quality='keep', subsampling='keep', optimize=False)
+            except ValueError:
+                # 'keep' is only accepted for plain JPEG sources (not MPO)
+                output = io.BytesIO()
+                img.save(output, "jpeg", exif=exif_bytes, quality=95)
+            return output.getvalue()
 
     except Exception as e:
-        print(f"Error injecting EXIF into {image_path}: {e}")
-        # Still try to update filesystem timestamps as fallback
-        try:
-            os.utime(image_path, (timestamp, timestamp))
-        except:
-            pass
-        return False
+        print(f"Error injecting EXIF: {e}")
+        return image_data
+
+
+def _iter_files(path):
+    """
+    Yield os.DirEntry objects for regular files under path, in the same
+    order as os.walk. DirEntry type checks come from the directory listing
+    itself, and entry.stat() is cached, so callers needing size or mtime
+    pay for at most one stat() per file.
+    """
+    stack = [path]
+    while stack:
+        subdirs = []
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+        # Reversed so the first subdirectory is walked next, as os.walk does
+        stack.extend(reversed(subdirs))
 
 
 def detect_export_type(extract_path):
     has_json_files = False
     has_photos = False
 
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            if file.lower().endswith('.json'):
-                has_json_files = True
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.heic', '.heif')):
-                has_photos = True
+    # Google Takeout is identified as soon as one JSON and one photo are seen
+    for entry in _iter_files(extract_path):
+        name = entry.name.lower()
+        if name.endswith('.json'):
+            has_json_files = True
+        elif name.endswith(DETECT_PHOTO_EXTS):
+            has_photos = True
+        else:
+            continue
 
         if has_json_files and has_photos:
             return 'google_takeout'
@@ -301,10 +683,195 @@ def detect_export_type(extract_path):
     return 'unknown'
 
 
-def process_google_takeout(extract_path, output_path,
-                           use_mtime_fallback=False,
-                           skip_no_metadata=False,
-                           remove_duplicates=False):
+def scan_export(extract_path):
+    """
+    One walk over the extracted tree. Returns (photos, sidecars): photos is
+    a list of (DirEntry, lower-cased extension) in walk order, sidecars the
+    set of JSON paths, so sidecar lookups need no stat calls.
+    """
+    photos = []
+    sidecars = set()
+    for entry in _iter_files(extract_path):
+        file_ext = _file_ext(entry.name)
+        if file_ext in PHOTO_EXTS:
+            photos.append((entry, file_ext))
+        elif entry.name.endswith('.json'):
+            sidecars.add(entry.path)
+    return photos, sidecars
+
+
+def get_google_takeout_timestamp(image_path, sidecars, parsed):
+    """
+    Looks up the photo's sidecar in the sidecars index. Results are memoized
+    in `parsed` (one dict per upload), so photos sharing a stem sidecar,
+    e.g. IMG_1234.jpg and IMG_1234.png -> IMG_1234.json, read it once.
+    """
+    json_path = image_path + '.json'
+    if json_path not in sidecars:
+        root, file = os.path.split(image_path)
+        # Same stem as pathlib's (dotfiles keep their name), without a Path object
+        dot = file.rfind('.')
+        stem = file[:dot] if 0 < dot < len(file) - 1 else file
+        json_path = os.path.join(root, stem + '.json')
+
+    if json_path in sidecars:
+        if json_path not in parsed:
+            parsed[json_path] = parse_google_takeout_json(json_path)
+        return parsed[json_path]
+    return None
+
+
+def _exif_for_writer(exif_dict):
+    # set_exif_datetime only looks at orientation and the three date tags;
+    # dropping the rest (thumbnails, MakerNotes) keeps queued entries small
+    if exif_dict is None:
+        return None
+    zeroth = exif_dict.get('0th', {})
+    exif = exif_dict.get('Exif', {})
+    return {
+        '0th': {tag: zeroth[tag] for tag in (piexif.ImageIFD.Orientation, piexif.ImageIFD.DateTime)
+                if tag in zeroth},
+        'Exif': {tag: exif[tag] for tag in (piexif.ExifIFD.DateTimeOriginal, piexif.ExifIFD.DateTimeDigitized)
+                 if tag in exif},
+    }
+
+
+def _hash_file(path, limit=None):
+    """
+    Returns the digest of the first `limit` bytes of a file, or of the
+    whole file when limit is None. Reads into one reused buffer.
+    """
+    hasher = new_hasher()
+    buf = memoryview(bytearray(COPY_BUFSIZE if limit is None else limit))
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(buf[:n])
+            if limit is not None:
+                break
+    return hasher.digest()
+
+
+def _find_duplicate(dup_key, image_path, file, seen_hashes):
+    """
+    Returns the kept filename that image_path duplicates, or None after
+    recording it. Files sharing a (size, head digest) probe are told
+    apart by full digests, computed lazily and only on a probe collision.
+    """
+    candidates = seen_hashes.setdefault(dup_key, [])
+    full = None
+    if candidates:
+        size, head = dup_key
+        full = head if size <= DEDUP_HEAD_SIZE else _hash_file(image_path)
+        for candidate in candidates:
+            if candidate[2] is None:
+                candidate[2] = _hash_file(candidate[0])
+            if candidate[2] == full:
+                return candidate[1]
+    candidates.append([image_path, file, full])
+    return None
+
+
+def _process_one(file_info, metadata_sources, use_mtime_fallback):
+    """
+    Per-file worker: probes the photo for dedup and resolves its timestamp.
+    Runs on a thread pool, so it must not touch shared state.
+    Returns (dup_key, timestamp, classification, is_wa, exif_dict).
+    """
+    image_path, file, file_ext, size, mtime = file_info
+
+    # ---- Duplicate probe, only for files whose size is not unique ----
+    dup_key = None
+    if size is not None:
+        dup_key = (size, _hash_file(image_path, DEDUP_HEAD_SIZE))
+
+    timestamp = None
+    classification = None
+    is_wa = False
+    exif_dict = None
+
+    # Export-specific sources first; the first one with an answer wins
+    for source in metadata_sources:
+        timestamp = source(image_path)
+        if timestamp is not None:
+            if timestamp:
+                classification = 'fixed'
+            break
+
+    if timestamp is None:
+        timestamp, exif_dict = get_exif_timestamp(image_path)
+        if timestamp is not None:
+            classification = 'fixed'
+
+    if timestamp is None:
+        xmp_data = extract_xmp_metadata(image_path)
+        if xmp_data and xmp_data['timestamp']:
+            timestamp = xmp_data['timestamp']
+            classification = 'fixed'
+
+    if timestamp is None:
+        timestamp, is_wa = get_timestamp_from_filename(file)
+        if timestamp:
+            classification = 'restored_from_filename'
+
+    if timestamp is None and use_mtime_fallback:
+        timestamp = int(mtime)
+        classification = 'fixed'
+
+    return dup_key, timestamp, classification, is_wa, _exif_for_writer(exif_dict)
+
+
+@lru_cache(maxsize=4096)
+def _format_timestamp(timestamp):
+    """
+    Returns (year folder name, 'YYYY-MM-DD_HH-MM-SS') for a timestamp.
+    Burst and Live Photo frames share a second, so results are cached, and
+    formatting is done by hand to skip strftime's locale handling.
+    """
+    dt = datetime.fromtimestamp(timestamp)
+    base_name = '%04d-%02d-%02d_%02d-%02d-%02d' % (
+        dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
+    return str(dt.year), base_name
+
+
+def _unique_name(folder, base_name, file_ext, used_names, next_suffix):
+    # Collision handling: _001, _002, ... (for same timestamp)
+    arcname = f"{folder}/{base_name}{file_ext}"
+    if arcname in used_names:
+        # Resume where the last collision on this name stopped; every lower
+        # suffix is already taken, so a burst doesn't re-probe from _001
+        key = (folder, base_name, file_ext)
+        counter = next_suffix.get(key, 1)
+        arcname = f"{folder}/{base_name}_{counter:03d}{file_ext}"
+        while arcname in used_names:
+            counter += 1
+            arcname = f"{folder}/{base_name}_{counter:03d}{file_ext}"
+        next_suffix[key] = counter + 1
+    used_names.add(arcname)
+    return arcname
+
+
+def process_photos(photos,
+                   metadata_sources=(),
+                   use_mtime_fallback=False,
+                   skip_no_metadata=False,
+                   remove_duplicates=False):
+    """
+    Shared pipeline for both export types, over the photos list from
+    scan_export. metadata_sources are export-specific callables
+    (image_path -> timestamp or None), tried in order before the generic
+    EXIF/XMP/filename/mtime chain.
+
+    Hashing and metadata lookup run on a thread pool; dedup, naming and
+    stats are applied in walk order on the calling thread so the output
+    is identical to a sequential run.
+
+    Nothing is written here. Returns (stats, entries, report): entries are
+    (arcname, image_path, timestamp, file_ext, exif_dict) tuples for
+    stream_output_zip, and report is the duplicates report text or None.
+    """
     stats = {
         'total_files': 0,
         'fixed': 0,
@@ -314,277 +881,218 @@ def process_google_takeout(extract_path, output_path,
         'duplicates_removed': 0
     }
 
-    photo_extensions = {'.jpg', '.jpeg', '.png', '.heic', '.heif', '.gif', '.bmp', '.webp'}
-    seen_hashes = {}       # key: (size, sha1) -> kept filename
+    seen_hashes = {}       # key: (size, head digest) -> [path, filename, full digest]
     duplicate_log = []     # for report file
-
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            file_lower = file.lower()
-            file_ext = Path(file_lower).suffix
-
-            if file_ext in photo_extensions:
-                stats['total_files'] += 1
-                image_path = os.path.join(root, file)
-
-                # ---- Duplicate detection (exact) ----
-                file_size = os.path.getsize(image_path)
-                sha1 = hashlib.sha1()
-                with open(image_path, 'rb') as f:
-                    for chunk in iter(lambda: f.read(8192), b''):
-                        sha1.update(chunk)
-                file_hash = sha1.hexdigest()
-                dup_key = (file_size, file_hash)
-
-                if remove_duplicates and dup_key in seen_hashes:
+    used_names = set()     # archive names already claimed
+    next_suffix = {}       # (folder, base, ext) -> next collision counter to try
+    entries = []
+
+    jobs = []
+    for entry, file_ext in photos:
+        # One cached stat serves both the dedup size and the mtime fallback
+        size = mtime = None
+        if remove_duplicates or use_mtime_fallback:
+            st = entry.stat()
+            size = st.st_size if remove_duplicates else None
+            mtime = st.st_mtime
+        jobs.append((entry.path, entry.name, file_ext, size, mtime))
+    stats['total_files'] = len(jobs)
+
+    # A file with a unique size cannot have a duplicate, so skip its probe
+    if remove_duplicates:
+        size_counts = {}
+        for job in jobs:
+            size_counts[job[3]] = size_counts.get(job[3], 0) + 1
+        jobs = [job if size_counts[job[3]] > 1 else job[:3] + (None,) + job[4:]
+                for job in jobs]
+
+    def analyze(file_info):
+        return _process_one(file_info, metadata_sources, use_mtime_fallback)
+
+    # Workers mostly wait on disk or run GIL-releasing C code, so
+    # oversubscribe the cores a little; past ~8 the disk is the limit.
+    workers = min(8, (os.cpu_count() or 1) * 2)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (image_path, file, file_ext, _, _), result in zip(jobs, executor.map(analyze, jobs)):
+            dup_key, timestamp, classification, is_wa, exif_dict = result
+
+            if dup_key is not None:
+                kept = _find_duplicate(dup_key, image_path, file, seen_hashes)
+                if kept is not None:
                     stats['duplicates_removed'] += 1
-                    duplicate_log.append(f"{file} -> duplicate of {seen_hashes[dup_key]}")
+                    duplicate_log.append(f"{file} -> duplicate of {kept}")
                     continue
+
+            if timestamp is None:
+                if skip_no_metadata:
+                    stats['skipped'] += 1
                 else:
-                    seen_hashes[dup_key] = file
+                    stem, ext = os.path.splitext(file)
+                    arcname = _unique_name('Needs_Review', stem, ext, used_names, next_suffix)
+                    entries.append((arcname, image_path, None, file_ext, None))
+                    stats['renamed_only'] += 1
+                continue
 
-                timestamp = None
-                classification = None
-                is_wa = False
+            year, base_name = _format_timestamp(timestamp)
 
-                json_path = image_path + '.json'
-                if not os.path.exists(json_path):
-                    json_path = os.path.join(root, Path(file).stem + '.json')
+            # New naming:
+            #   YYYY-MM-DD_HH-MM-SS.ext              → normal
+            #   YYYY-MM-DD_HH-MM-SS_WA.ext          → WhatsApp
+            #   YYYY-MM-DD_HH-MM-SS_FN.ext          → date from filename (no EXIF)
+            #   YYYY-MM-DD_HH-MM-SS_WA_FN.ext       → WA + from filename
+            # Flags
+            from_filename = (classification == 'restored_from_filename')
 
-                if os.path.exists(json_path):
-                    timestamp = parse_google_takeout_json(json_path)
-                    if timestamp:
-                        classification = 'fixed'
+            if is_wa:
+                base_name += '_WA'
+            if from_filename:
+                base_name += '_FN'
 
-                if timestamp is None:
-                    try:
-                        img = Image.open(image_path)
-                        exif_dict = piexif.load(img.info.get('exif', b''))
-                        if piexif.ExifIFD.DateTimeOriginal in exif_dict.get('Exif', {}):
-                            date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                            dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                            timestamp = int(dt.timestamp())
-                            classification = 'fixed'
-                    except:
-                        pass
+            arcname = _unique_name(year, base_name, file_ext, used_names, next_suffix)
+            entries.append((arcname, image_path, timestamp, file_ext, exif_dict))
 
-                if timestamp is None:
-                    xmp_data = extract_xmp_metadata(image_path)
-                    if xmp_data and xmp_data['timestamp']:
-                        timestamp = xmp_data['timestamp']
-                        classification = 'fixed'
+            if classification:
+                stats[classification] += 1
 
-                if timestamp is None:
-                    timestamp, is_wa = get_timestamp_from_filename(file)
-                    if timestamp:
-                        classification = 'restored_from_filename'
-
-                if timestamp is None and use_mtime_fallback:
-                    try:
-                        mtime = os.path.getmtime(image_path)
-                        timestamp = int(mtime)
-                        classification = 'fixed'
-                    except:
-                        pass
+    # Duplicate report (if any)
+    report = None
+    if remove_duplicates and stats['duplicates_removed'] > 0:
+        report = f"Duplicates removed: {stats['duplicates_removed']}\n\n"
+        report += "".join(line + "\n" for line in duplicate_log)
 
-                if timestamp is None:
-                    if skip_no_metadata:
-                        stats['skipped'] += 1
-                        continue
-                    else:
-                        classification = 'renamed_only'
-                        needs_review_folder = os.path.join(output_path, 'Needs_Review')
-                        os.makedirs(needs_review_folder, exist_ok=True)
-                        new_path = os.path.join(needs_review_folder, file)
-                        shutil.copy2(image_path, new_path)
-                        stats['renamed_only'] += 1
-                        continue
-
-                dt = datetime.fromtimestamp(timestamp)
-                year_folder = os.path.join(output_path, str(dt.year))
-                os.makedirs(year_folder, exist_ok=True)
-
-                # New naming:
-                #   YYYY-MM-DD_HH-MM-SS.ext              → normal
-                #   YYYY-MM-DD_HH-MM-SS_WA.ext          → WhatsApp
-                #   YYYY-MM-DD_HH-MM-SS_FN.ext          → date from filename (no EXIF)
-                #   YYYY-MM-DD_HH-MM-SS_WA_FN.ext       → WA + from filename
-                base_name = dt.strftime('%Y-%m-%d_%H-%M-%S')
-
-                # Flags
-                from_filename = (classification == 'restored_from_filename')
-
-                if is_wa:
-                    base_name += '_WA'
-                if from_filename:
-                    base_name += '_FN'
-
-                new_filename = f"{base_name}{file_ext}"
-                new_path = os.path.join(year_folder, new_filename)
-
-                # Collision handling: _001, _002, ... (for same timestamp)
-                counter = 1
-                while os.path.exists(new_path):
-                    new_filename = f"{base_name}_{counter:03d}{file_ext}"
-                    new_path = os.path.join(year_folder, new_filename)
-                    counter += 1
-
-                shutil.copy2(image_path, new_path)
-
-                if file_ext in {'.jpg', '.jpeg'}:
-                    set_exif_datetime(new_path, timestamp)
-                else:
-                    os.utime(new_path, (timestamp, timestamp))
+    return stats, entries, report
 
-                if classification:
-                    stats[classification] += 1
 
-    # Write duplicate report (if any)
-    if remove_duplicates and stats['duplicates_removed'] > 0:
-        report_path = os.path.join(output_path, 'duplicates_report.txt')
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(f"Duplicates removed: {stats['duplicates_removed']}\n\n")
-            for line in duplicate_log:
-                f.write(line + "\n")
-
-    return stats
+def process_google_takeout(extract_path,
+                           use_mtime_fallback=False,
+                           skip_no_metadata=False,
+                           remove_duplicates=False):
+    photos, sidecars = scan_export(extract_path)
+    parsed = {}  # per-upload memo; a global cache could outlive the temp paths
+    return process_photos(photos,
+                          [lambda image_path: get_google_takeout_timestamp(image_path, sidecars, parsed)],
+                          use_mtime_fallback,
+                          skip_no_metadata,
+                          remove_duplicates)
 
 
-def process_apple_photos(extract_path, output_path,
+def process_apple_photos(extract_path,
                          use_mtime_fallback=False,
                          skip_no_metadata=False,
                          remove_duplicates=False):
-    stats = {
-        'total_files': 0,
-        'fixed': 0,
-        'restored_from_filename': 0,
-        'renamed_only': 0,
-        'skipped': 0,
-        'duplicates_removed': 0
-    }
+    photos = scan_export(extract_path)[0]
+    exif_timestamps = read_exif_timestamps_exiftool([entry.path for entry, _ in photos])
+    return process_photos(photos,
+                          [exif_timestamps.get] if exif_timestamps else [],
+                          use_mtime_fallback,
+                          skip_no_metadata,
+                          remove_duplicates)
 
-    photo_extensions = {'.jpg', '.jpeg', '.png', '.heic', '.heif', '.gif', '.bmp', '.webp'}
-    seen_hashes = {}
-    duplicate_log = []
-
-    for root, dirs, files in os.walk(extract_path):
-        for file in files:
-            file_lower = file.lower()
-            file_ext = Path(file_lower).suffix
-
-            if file_ext in photo_extensions:
-                stats['total_files'] += 1
-                image_path = os.path.join(root, file)
-
-                # ---- Duplicate detection (exact) ----
-                file_size = os.path.getsize(image_path)
-                sha1 = hashlib.sha1()
-                with open(image_path, 'rb') as f:
-                    for chunk in iter(lambda: f.read(8192), b''):
-                        sha1.update(chunk)
-                file_hash = sha1.hexdigest()
-                dup_key = (file_size, file_hash)
-
-                if remove_duplicates and dup_key in seen_hashes:
-                    stats['duplicates_removed'] += 1
-                    duplicate_log.append(f"{file} -> duplicate of {seen_hashes[dup_key]}")
-                    continue
-                else:
-                    seen_hashes[dup_key] = file
 
-                timestamp = None
-                classification = None
-                is_wa = False
+class _ZipStream:
+    """
+    Write-only sink for zipfile.ZipFile that hands back whatever has been
+    written so far. It has no seek(), so ZipFile uses data descriptors
+    instead of going back to patch local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
 
-                try:
-                    img = Image.open(image_path)
-                    exif_dict = piexif.load(img.info.get('exif', b''))
-                    if piexif.ExifIFD.DateTimeOriginal in exif_dict.get('Exif', {}):
-                        date_str = exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal].decode('utf-8')
-                        dt = datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                        timestamp = int(dt.timestamp())
-                        classification = 'fixed'
-                except:
-                    pass
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
 
-                if timestamp is None:
-                    xmp_data = extract_xmp_metadata(image_path)
-                    if xmp_data and xmp_data['timestamp']:
-                        timestamp = xmp_data['timestamp']
-                        classification = 'fixed'
+    def flush(self):
+        pass
 
-                if timestamp is None:
-                    timestamp, is_wa = get_timestamp_from_filename(file)
-                    if timestamp:
-                        classification = 'restored_from_filename'
-
-                if timestamp is None and use_mtime_fallback:
-                    try:
-                        mtime = os.path.getmtime(image_path)
-                        timestamp = int(mtime)
-                        classification = 'fixed'
-                    except:
-                        pass
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_info(arcname, timestamp):
+    date_time = datetime.fromtimestamp(timestamp).timetuple()[:6]
+    # ZIP can only represent 1980-2107; clamp like strict_timestamps=False
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    elif date_time[0] > 2107:
+        date_time = (2107, 12, 31, 23, 59, 59)
+    info = zipfile.ZipInfo(arcname, date_time)
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def _patched_jpeg(image_path, timestamp, exif_dict):
+    with open(image_path, 'rb') as src:
+        image_data = src.read()
+    return set_exif_datetime(image_data, timestamp, exif_dict)
 
+
+def stream_output_zip(entries, report=None):
+    """
+    Yield the output ZIP chunk by chunk as it is built, reading photos
+    straight from the extracted tree. JPEG dates are patched in memory and
+    every entry carries the photo's timestamp, so no output tree is needed.
+
+    A small pool reads and patches the next few JPEGs while the current
+    one is written out; at most OUTPUT_PREFETCH entries are held in memory
+    and the archive order is unchanged.
+    """
+    sink = _ZipStream()
+    buf = memoryview(bytearray(COPY_BUFSIZE))  # reused for every streamed file
+    entries = iter(entries)
+    pending = deque()  # (entry, future of patched JPEG bytes or None)
+
+    def queue_entries(pool):
+        while len(pending) < OUTPUT_PREFETCH:
+            entry = next(entries, None)
+            if entry is None:
+                return
+            _, image_path, timestamp, file_ext, exif_dict = entry
+            future = None
+            if timestamp is not None and file_ext in JPEG_EXTS:
+                future = pool.submit(_patched_jpeg, image_path, timestamp, exif_dict)
+            pending.append((entry, future))
+
+    try:
+        # Photos are already compressed, so store them instead of deflating
+        with ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as pool, \
+                zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            queue_entries(pool)
+            while pending:
+                (arcname, image_path, timestamp, file_ext, exif_dict), future = pending.popleft()
+                queue_entries(pool)
                 if timestamp is None:
-                    if skip_no_metadata:
-                        stats['skipped'] += 1
-                        continue
-                    else:
-                        classification = 'renamed_only'
-                        needs_review_folder = os.path.join(output_path, 'Needs_Review')
-                        os.makedirs(needs_review_folder, exist_ok=True)
-                        new_path = os.path.join(needs_review_folder, file)
-                        shutil.copy2(image_path, new_path)
-                        stats['renamed_only'] += 1
-                        continue
-
-                dt = datetime.fromtimestamp(timestamp)
-                year_folder = os.path.join(output_path, str(dt.year))
-                os.makedirs(year_folder, exist_ok=True)
-
-                # New naming:
-                #   YYYY-MM-DD_HH-MM-SS.ext              → normal
-                #   YYYY-MM-DD_HH-MM-SS_WA.ext          → WhatsApp
-                #   YYYY-MM-DD_HH-MM-SS_FN.ext          → date from filename (no EXIF)
-                #   YYYY-MM-DD_HH-MM-SS_WA_FN.ext       → WA + from filename
-                base_name = dt.strftime('%Y-%m-%d_%H-%M-%S')
-
-                from_filename = (classification == 'restored_from_filename')
-
-                if is_wa:
-                    base_name += '_WA'
-                if from_filename:
-                    base_name += '_FN'
-
-                new_filename = f"{base_name}{file_ext}"
-                new_path = os.path.join(year_folder, new_filename)
-
-                # Collision handling: _001, _002, ...
-                counter = 1
-                while os.path.exists(new_path):
-                    new_filename = f"{base_name}_{counter:03d}{file_ext}"
-                    new_path = os.path.join(year_folder, new_filename)
-                    counter += 1
-
-                shutil.copy2(image_path, new_path)
-
-                if file_ext in {'.jpg', '.jpeg'}:
-                    set_exif_datetime(new_path, timestamp)
+                    # Needs_Review files are passed through untouched
+                    info = zipfile.ZipInfo.from_file(image_path, arcname, strict_timestamps=False)
+                    info.compress_type = zipfile.ZIP_STORED
                 else:
-                    os.utime(new_path, (timestamp, timestamp))
+                    info = _zip_info(arcname, timestamp)
 
-                if classification:
-                    stats[classification] += 1
-
-    if remove_duplicates and stats['duplicates_removed'] > 0:
-        report_path = os.path.join(output_path, 'duplicates_report.txt')
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write(f"Duplicates removed: {stats['duplicates_removed']}\n\n")
-            for line in duplicate_log:
-                f.write(line + "\n")
+                if future is not None:
+                    zipf.writestr(info, future.result())
+                    yield sink.drain()
+                    continue
 
-    return stats
+                with open(image_path, 'rb', buffering=0) as src, zipf.open(info, 'w') as dst:
+                    while True:
+                        n = src.readinto(buf)
+                        if not n:
+                            break
+                        dst.write(buf[:n])
+                        yield sink.drain()
+
+            if report is not None:
+                zipf.writestr(_zip_info('duplicates_report.txt', datetime.now().timestamp()),
+                              report.encode('utf-8'))
+        yield sink.drain()
+    except Exception as e:
+        # Headers are already sent, so the client just sees a truncated download
+        print(f"Error streaming output ZIP: {e}")
+        raise
 
 
 @app.route('/health')
@@ -624,19 +1132,11 @@ def upload_file():
             cleanup_temp_dirs(temp_dirs)
             return jsonify({'error': 'This free web version supports ZIP files up to 200MB.'}), 400
 
-        upload_dir = tempfile.mkdtemp(prefix='upload_')
-        temp_dirs.append(upload_dir)
         extract_dir = tempfile.mkdtemp(prefix='extract_')
         temp_dirs.append(extract_dir)
-        output_dir = tempfile.mkdtemp(prefix='output_')
-        temp_dirs.append(output_dir)
-
-        filename = secure_filename(file.filename or 'upload.zip')
-        zip_path = os.path.join(upload_dir, filename)
-        file.save(zip_path)
 
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            safe_extract_zip(zip_ref, extract_dir)
+        with open_upload_zip(file, temp_dirs) as zip_ref:
+            safe_extract_zip(zip_ref, extract_dir, EXTRACT_EXTS)
 
         export_type = detect_export_type(extract_dir)
 
@@ -649,35 +1149,25 @@ def upload_file():
             return jsonify({'error': 'Could not detect export type. Please upload a valid Google Takeout or Apple Photos export.'}), 400
 
         if export_type == 'google_takeout':
-            stats = process_google_takeout(
+            stats, entries, report = process_google_takeout(
                 extract_dir,
-                output_dir,
                 use_mtime_fallback,
                 skip_no_metadata,
                 remove_duplicates
             )
         else:
-            stats = process_apple_photos(
+            stats, entries, report = process_apple_photos(
                 extract_dir,
-                output_dir,
                 use_mtime_fallback,
                 skip_no_metadata,
                 remove_duplicates
             )
 
-        output_zip_path = os.path.join(upload_dir, 'fixed_photos.zip')
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(output_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, output_dir)
-                    zipf.write(file_path, arcname)
-
-        response = send_file(
-            output_zip_path,
-            as_attachment=True,
-            download_name='fixed_photos.zip',
-            mimetype='application/zip'
+        # The ZIP is built while it is being sent; temp dirs are removed on close
+        response = Response(
+            stream_output_zip(entries, report),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=fixed_photos.zip'}
         )
 
         @response.call_on_close
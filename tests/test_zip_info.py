@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+import zipfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def _ts(*args):
+    return datetime(*args).timestamp()
+
+
+def test_zip_info_clamps_dates_before_1980():
+    info = app._zip_info('1970/a.png', _ts(1975, 6, 1, 12, 0, 0))
+    assert info.date_time == (1980, 1, 1, 0, 0, 0)
+
+
+def test_zip_info_clamps_dates_after_2107():
+    info = app._zip_info('2150/a.png', _ts(2150, 6, 1, 12, 0, 0))
+    assert info.date_time == (2107, 12, 31, 23, 59, 59)
+
+
+def test_zip_info_keeps_dates_in_range():
+    info = app._zip_info('2020/a.png', _ts(2020, 1, 2, 3, 4, 6))
+    assert info.date_time == (2020, 1, 2, 3, 4, 6)
+
+
+def test_stream_output_zip_with_out_of_range_dates(tmp_path):
+    photo = tmp_path / 'a.png'
+    photo.write_bytes(b'not really a png')
+    entries = [
+        ('1970/old.png', str(photo), _ts(1975, 1, 1, 0, 0, 0), '.png', None),
+        ('2150/future.png', str(photo), _ts(2150, 1, 1, 0, 0, 0), '.png', None),
+    ]
+
+    data = b''.join(app.stream_output_zip(entries))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo('1970/old.png').date_time == (1980, 1, 1, 0, 0, 0)
+        # DOS timestamps have 2-second resolution
+        assert zf.getinfo('2150/future.png').date_time == (2107, 12, 31, 23, 59, 58)